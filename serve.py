@@ -1,41 +1,134 @@
 # serve.py
 import os
+import math
+import tempfile
+import asyncio
+import inspect
 import json
+import logging
 import time
+import atexit
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple, get_origin
 from dataclasses import dataclass
-from functools import lru_cache
+from functools import lru_cache, partial, wraps
+from operator import attrgetter
 import mcp.types as types
 
 from mcp.server.fastmcp import FastMCP
 from mcp.server.transport_security import TransportSecuritySettings
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
 from starlette.responses import JSONResponse
 
 # --- Weaviate client imports (v4) ---
 import weaviate
-from weaviate.classes.init import Auth
+from weaviate.classes.init import AdditionalConfig, Auth, Timeout
+from weaviate.config import ConnectionConfig
 from weaviate.classes.query import MetadataQuery
 
+# Trasporto HTTP per i refresh OAuth Google
+import requests
+from google.auth.transport.requests import Request
+
 # OpenAI client per descrizioni immagini
 from openai import OpenAI
 
+from cachetools import TTLCache
+import orjson
+
 _OPENAI_CLIENT = None
 if os.environ.get("OPENAI_API_KEY"):
     _OPENAI_CLIENT = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
 else:
     print("[query-caption] WARNING: OPENAI_API_KEY non impostata, niente descrizioni testuali per le query.")
 
-# In-memory stato Vertex
-_VERTEX_HEADERS: Dict[str, str] = {}
+# Client Weaviate condiviso (creato una sola volta e riusato da tutti i tool)
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+# Token OAuth Vertex con cui è stato costruito _CLIENT: il client v4 fissa gli
+# header (REST e gRPC) alla connessione, quindi a ogni nuovo token va ricreato
+_CLIENT_VERTEX_TOKEN: Optional[str] = None
+
+# Budget di tempo per singola chiamata a un tool (ms, 0 = nessun limite)
+_TOOL_BUDGET_MS = int(os.environ.get("MCP_TOOL_BUDGET_MS", "8000"))
+_TOOL_BUDGET_S: Optional[float] = _TOOL_BUDGET_MS / 1000 if _TOOL_BUDGET_MS > 0 else None
+
+# Timeout delle query Weaviate (secondi interi): di default pari al budget dei
+# tool, così allo scadere del budget anche la chiamata nel thread del pool si
+# interrompe e lo libera (senza budget resta il default di 30s)
+_WEAVIATE_QUERY_TIMEOUT = int(
+    os.environ.get("WEAVIATE_QUERY_TIMEOUT")
+    or (max(1, math.floor(_TOOL_BUDGET_S)) if _TOOL_BUDGET_S else 30)
+)
+
+# Un client sostituito (nuovo token) resta aperto per questo intervallo, così
+# le query già avviate con il vecchio client possono terminare
+_CLIENT_RETIRE_GRACE_S = max(60, 2 * _WEAVIATE_QUERY_TIMEOUT)
+
+# Pool di connessioni HTTP e timeout del client condiviso, dimensionati per
+# chiamate concorrenti ai tool (sovrascrivibili da env)
+_WEAVIATE_ADDITIONAL_CONFIG = AdditionalConfig(
+    timeout=Timeout(
+        query=_WEAVIATE_QUERY_TIMEOUT,
+        insert=int(os.environ.get("WEAVIATE_INSERT_TIMEOUT", "60")),
+    ),
+    connection=ConnectionConfig(
+        session_pool_connections=int(os.environ.get("WEAVIATE_POOL_CONNECTIONS", "20")),
+        session_pool_maxsize=int(os.environ.get("WEAVIATE_POOL_MAXSIZE", "50")),
+        session_pool_max_retries=int(os.environ.get("WEAVIATE_POOL_MAX_RETRIES", "3")),
+    ),
+)
+
+# In-memory stato Vertex: header e token vengono ricostruiti insieme a ogni
+# refresh e pubblicati come oggetti immutabili
+_VERTEX_HEADERS: Mapping[str, str] = MappingProxyType({})
+_VERTEX_TOKEN: Optional[str] = None
+_VERTEX_TOKEN_EXPIRY: Optional[datetime] = None
+_VERTEX_SA_CREDS = None
+_VERTEX_SA_CREDS_PATH: Optional[str] = None
+_VERTEX_REFRESH_LOCK = threading.Lock()
+# Unico trasporto per i refresh: la Session mantiene viva la connessione TLS
+# verso oauth2.googleapis.com (usata solo sotto _VERTEX_REFRESH_LOCK)
+_AUTH_REQUEST = Request(session=requests.Session())
 _VERTEX_REFRESH_THREAD_STARTED = False
+_VERTEX_STOP = threading.Event()
 _VERTEX_USER_PROJECT: Optional[str] = None
 
 _BASE_DIR = Path(__file__).resolve().parent
 _DEFAULT_PROMPT_PATH = _BASE_DIR / "prompts" / "instructions.md"
 _DEFAULT_DESCRIPTION_PATH = _BASE_DIR / "prompts" / "description.txt"
 _BASE_URL = os.environ.get("BASE_URL", "https://weaviate-openai-app-sdk.onrender.com")
+# File ADC scritto da GOOGLE_APPLICATION_CREDENTIALS_JSON (directory temporanea:
+# la cartella del progetto non è sempre scrivibile, né sempre /app)
+_ADC_JSON_PATH = os.path.join(tempfile.gettempdir(), "gcp_credentials.json")
+
+# Logging: livello da LOG_LEVEL (default INFO); DEBUG=1 abilita anche i log di dettaglio
+_LOG_LEVEL = ("DEBUG" if os.environ.get("DEBUG") else os.environ.get("LOG_LEVEL", "INFO")).upper()
+if not isinstance(logging.getLevelName(_LOG_LEVEL), int):
+    # livello sconosciuto: non blocchiamo l'avvio, ripieghiamo su INFO
+    print(f"[mcp] WARNING: LOG_LEVEL non valido ({_LOG_LEVEL}), uso INFO")
+    _LOG_LEVEL = "INFO"
+# Il root logger non scende sotto INFO: il DEBUG vale solo per i logger del
+# server, non per httpx/grpc/openai/google-auth/SDK mcp
+logging.basicConfig(
+    level=max(logging.getLevelName(_LOG_LEVEL), logging.INFO),
+    format="[%(name)s] %(message)s",
+)
+_VERTEX_LOGGER = logging.getLogger("vertex-oauth")
+_SEARCH_LOGGER = logging.getLogger("hybrid_search")
+_MCP_LOGGER = logging.getLogger("mcp.serve")
+_WEAVIATE_LOGGER = logging.getLogger("weaviate-client")
+for _logger in (_VERTEX_LOGGER, _SEARCH_LOGGER, _MCP_LOGGER, _WEAVIATE_LOGGER):
+    _logger.setLevel(_LOG_LEVEL)
+if os.environ.get("MCP_DEBUG"):
+    _MCP_LOGGER.setLevel(logging.DEBUG)
 
 
 def _build_vertex_header_map(token: str) -> Dict[str, str]:
@@ -53,6 +146,17 @@ def _build_vertex_header_map(token: str) -> Dict[str, str]:
     return headers
 
 
+@lru_cache(maxsize=4)
+def _load_service_account_info(path: str) -> Dict[str, Any]:
+    """
+    Legge e decodifica il JSON della service account una sola volta per path.
+    """
+    with open(path, "rb") as f:
+        data = json.load(f)
+    return data if isinstance(data, dict) else {}
+
+
+@lru_cache(maxsize=1)
 def _discover_gcp_project() -> Optional[str]:
     gac_json = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS_JSON")
     if gac_json:
@@ -66,9 +170,8 @@ def _discover_gcp_project() -> Optional[str]:
     gac_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
     if gac_path and os.path.exists(gac_path):
         try:
-            with open(gac_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if isinstance(data, dict) and data.get("project_id"):
+            data = _load_service_account_info(gac_path)
+            if data.get("project_id"):
                 return data["project_id"]
         except Exception:
             pass
@@ -100,11 +203,16 @@ def _get_weaviate_api_key() -> str:
     return api_key
 
 
-def _resolve_service_account_path() -> Optional[str]:
+@lru_cache(maxsize=1)
+def _resolve_service_account_path_cached() -> Tuple[Optional[str], Optional[str]]:
+    """
+    Individua il file della service account e il relativo project_id una sola
+    volta per processo. Usa reload_credentials() per invalidare la cache.
+    """
     gac_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
     if gac_path and os.path.exists(gac_path):
         _load_vertex_user_project(gac_path)
-        return gac_path
+        return gac_path, _VERTEX_USER_PROJECT
 
     candidates = [
         os.environ.get("VERTEX_SA_PATH"),
@@ -114,8 +222,12 @@ def _resolve_service_account_path() -> Optional[str]:
         if candidate and os.path.exists(candidate):
             os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = candidate
             _load_vertex_user_project(candidate)
-            return candidate
-    return None
+            return candidate, _VERTEX_USER_PROJECT
+    return None, None
+
+
+def _resolve_service_account_path() -> Optional[str]:
+    return _resolve_service_account_path_cached()[0]
 
 
 def _load_vertex_user_project(path: str) -> None:
@@ -123,74 +235,94 @@ def _load_vertex_user_project(path: str) -> None:
     if _VERTEX_USER_PROJECT:
         return
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _load_service_account_info(path)
         _VERTEX_USER_PROJECT = data.get("project_id")
         if not _VERTEX_USER_PROJECT and data.get("quota_project_id"):
             _VERTEX_USER_PROJECT = data["quota_project_id"]
         if _VERTEX_USER_PROJECT:
-            try:
-                print(
-                    f"[vertex-oauth] detected service account project: {_VERTEX_USER_PROJECT}"
-                )
-            except (ValueError, OSError):
-                pass
+            _VERTEX_LOGGER.info(
+                "detected service account project: %s", _VERTEX_USER_PROJECT
+            )
         else:
-            try:
-                print(
-                    "[vertex-oauth] warning: project_id not found in service account JSON"
-                )
-            except (ValueError, OSError):
-                pass
+            _VERTEX_LOGGER.warning("project_id not found in service account JSON")
     except Exception as exc:
-        try:
-            print(f"[vertex-oauth] unable to read project id from SA: {exc}")
-        except (ValueError, OSError):
-            pass
+        _VERTEX_LOGGER.warning("unable to read project id from SA: %s", exc)
 
 
-def _sync_refresh_vertex_token() -> bool:
+def _vertex_token_valid() -> bool:
     """
-    Refresh sincrono del token OAuth2 Vertex dalla service account.
-    Restituisce True se il refresh ha successo, False altrimenti.
+    True se abbiamo un token Vertex in cache che scade tra più di 5 minuti.
     """
-    try:
-        from google.oauth2 import service_account
-        from google.auth.transport.requests import Request
-    except Exception as exc:
-        print(f"[vertex-oauth] sync refresh unavailable: {exc}")
+    if not _VERTEX_HEADERS or _VERTEX_TOKEN_EXPIRY is None:
         return False
+    # google-auth espone expiry come datetime naive in UTC
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return (_VERTEX_TOKEN_EXPIRY - now).total_seconds() > 300
 
-    cred_path = _resolve_service_account_path()
-    if not cred_path or not os.path.exists(cred_path):
-        print(f"[vertex-oauth] service account path not found: {cred_path}")
-        return False
-    
-    try:
-        creds = service_account.Credentials.from_service_account_file(
-            cred_path,
+
+def _get_vertex_sa_credentials(cred_path: str):
+    """
+    Restituisce le credenziali della service account, costruite (parsing della
+    chiave RSA incluso) una sola volta per path e riusate a ogni refresh.
+    Il JSON è lo stesso già decodificato da _load_service_account_info.
+    """
+    global _VERTEX_SA_CREDS, _VERTEX_SA_CREDS_PATH
+    if _VERTEX_SA_CREDS is None or _VERTEX_SA_CREDS_PATH != cred_path:
+        from google.oauth2 import service_account
+
+        _VERTEX_SA_CREDS = service_account.Credentials.from_service_account_info(
+            _load_service_account_info(cred_path),
             scopes=["https://www.googleapis.com/auth/cloud-platform"],
         )
-        creds.refresh(Request())
-    except Exception as exc:
-        print(f"[vertex-oauth] sync refresh error: {exc}")
-        return False
+        _VERTEX_SA_CREDS_PATH = cred_path
+    return _VERTEX_SA_CREDS
 
-    token = creds.token
-    if not token:
-        print("[vertex-oauth] token is None after refresh")
-        return False
-    
-    global _VERTEX_HEADERS
-    _VERTEX_HEADERS = _build_vertex_header_map(token)
-    print(f"[vertex-oauth] sync token refresh for text2vec-google (prefix: {token[:10]}...)")
-    # Aggiorna anche le variabili d'ambiente per Weaviate vectorizer
-    os.environ["GOOGLE_APIKEY"] = token
-    os.environ["PALM_APIKEY"] = token
-    return True
 
+def _sync_refresh_vertex_token(force: bool = False) -> bool:
+    """
+    Refresh sincrono del token OAuth2 Vertex dalla service account.
+    Restituisce True se il refresh ha successo, False altrimenti.
 
-def _connect():
+    Il refresh è serializzato da _VERTEX_REFRESH_LOCK: se più richieste
+    trovano il token scaduto, solo la prima contatta Google e le altre
+    riusano il token appena ottenuto (salvo force=True).
+    """
+    with _VERTEX_REFRESH_LOCK:
+        if not force and _vertex_token_valid():
+            return True
+
+        cred_path = _resolve_service_account_path()
+        if not cred_path or not os.path.exists(cred_path):
+            _VERTEX_LOGGER.warning("service account path not found: %s", cred_path)
+            return False
+
+        try:
+            creds = _get_vertex_sa_credentials(cred_path)
+            creds.refresh(_AUTH_REQUEST)
+        except Exception as exc:
+            _VERTEX_LOGGER.warning("sync refresh error: %s", exc)
+            return False
+
+        token = creds.token
+        if not token:
+            _VERTEX_LOGGER.warning("token is None after refresh")
+            return False
+
+        # Swap atomico: il dict viene costruito per intero e poi pubblicato,
+        # mai modificato in place, così i lettori vedono sempre uno stato coerente
+        global _VERTEX_HEADERS, _VERTEX_TOKEN, _VERTEX_TOKEN_EXPIRY
+        _VERTEX_HEADERS = MappingProxyType(_build_vertex_header_map(token))
+        _VERTEX_TOKEN = token
+        _VERTEX_TOKEN_EXPIRY = creds.expiry
+        _VERTEX_LOGGER.debug("sync token refresh for text2vec-google (prefix: %s...)", token[:10])
+        # Aggiorna anche le variabili d'ambiente per Weaviate vectorizer
+        # (unico punto di scrittura per il token OAuth, sotto lock)
+        os.environ["GOOGLE_APIKEY"] = token
+        os.environ["PALM_APIKEY"] = token
+        return True
+
+
+def _connect() -> Tuple[Any, Optional[str]]:
     """
     Connessione a Weaviate Cloud usando:
     - API key del cluster (WEAVIATE_API_KEY)
@@ -199,10 +331,13 @@ def _connect():
     Questo replica il pattern del codice di esempio:
     il token viene generato dalla service account e passato a Weaviate
     come "API key" per text2vec-google.
+
+    Restituisce (client, token OAuth corrente al momento della connessione).
     """
     url = _get_weaviate_url()
     key = _get_weaviate_api_key()
     _resolve_service_account_path()
+    oauth_token = _VERTEX_TOKEN
 
     headers: Dict[str, str] = {}
     
@@ -211,124 +346,121 @@ def _connect():
     if openai_key:
         headers["X-OpenAI-Api-Key"] = openai_key
 
-    # 1) Refresh esplicito del token OAuth2 dalla service account (come nel codice di esempio)
+    # 1) Chiave statica/bearer oppure token OAuth2 della service account
     vertex_token = (
         os.environ.get("VERTEX_APIKEY")
         or os.environ.get("VERTEX_BEARER_TOKEN")
     )
     
-    # Se non c'è una chiave statica/bearer, usa OAuth con refresh esplicito
-    if not vertex_token:
-        # Assicurati che _VERTEX_HEADERS contenga il token (refresh se necessario)
-        if not ("_VERTEX_HEADERS" in globals() and _VERTEX_HEADERS and _VERTEX_HEADERS.get("X-Goog-Vertex-Api-Key")):
-            # Refresh esplicito del token (come nel codice di esempio)
-            if not _sync_refresh_vertex_token():
-                print("[vertex-oauth] WARNING: failed to refresh Vertex token")
-        # Prendi il token da _VERTEX_HEADERS
-        if "_VERTEX_HEADERS" in globals() and _VERTEX_HEADERS:
-            vertex_token = _VERTEX_HEADERS.get("X-Goog-Vertex-Api-Key")
-    
-    # 2) Build header HTTP per le chiamate REST (come nel codice di esempio)
     if vertex_token:
-        headers.update(_build_vertex_header_map(vertex_token))
-        # Aggiorna anche le variabili d'ambiente per Weaviate vectorizer (fallback)
+        # Chiave statica/bearer: header costruiti al volo
+        vertex_headers: Mapping[str, str] = _build_vertex_header_map(vertex_token)
+        # La chiave statica non cambia: env per Weaviate vectorizer (fallback)
+        # impostate qui, una volta per connessione. Con OAuth lo fa il refresh.
         os.environ["GOOGLE_APIKEY"] = vertex_token
         os.environ["PALM_APIKEY"] = vertex_token
-        print(f"[vertex-oauth] using Vertex token for text2vec-google (prefix: {vertex_token[:10]}...)")
     else:
-        print("[vertex-oauth] WARNING: no Vertex token available for connection")
+        # OAuth: header e token vengono mantenuti aggiornati dal refresher
+        # in background, qui li leggiamo e basta. Il token va letto prima
+        # degli header (il refresh pubblica gli header prima del token): così
+        # non registriamo mai un token più nuovo di quello usato dal client
+        vertex_token = oauth_token
+        vertex_headers = _VERTEX_HEADERS
+    
+    # 2) Build header HTTP per le chiamate REST (come nel codice di esempio)
+    if vertex_token:
+        headers.update(vertex_headers)
+        _VERTEX_LOGGER.debug(
+            "using Vertex token for text2vec-google (prefix: %s...)", vertex_token[:10]
+        )
+    else:
+        _VERTEX_LOGGER.warning("no Vertex token available for connection")
 
-    # 3) Crea client Weaviate con header
+    # 3) Crea client Weaviate con header (usati sia per REST sia per gRPC)
     client = weaviate.connect_to_weaviate_cloud(
         cluster_url=url,
         auth_credentials=Auth.api_key(key),
         headers=headers or None,
+        additional_config=_WEAVIATE_ADDITIONAL_CONFIG,
     )
+    return client, oauth_token
 
-    # 4) Metadata gRPC (per sicurezza, come nel codice di esempio)
-    if vertex_token:
-        try:
-            conn = getattr(client, "_connection", None)
-            if conn is not None:
-                meta_list = [
-                    ("x-goog-vertex-api-key", vertex_token),
-                ]
-                project_id = _VERTEX_USER_PROJECT or _discover_gcp_project()
-                if project_id:
-                    meta_list.append(("x-goog-user-project", project_id))
-                
-                # Prova a settare vari modalità (come nel tuo serve.py e nel codice di esempio)
-                try:
-                    setattr(conn, "grpc_metadata", meta_list)
-                except Exception:
-                    pass
-                try:
-                    setattr(conn, "_grpc_metadata", meta_list)
-                except Exception:
-                    pass
-                if hasattr(conn, "set_grpc_metadata"):
-                    try:
-                        conn.set_grpc_metadata(meta_list)
-                    except Exception:
-                        pass
-                debug_meta = getattr(conn, "grpc_metadata", None)
-                print(f"[vertex-oauth] gRPC metadata set for text2vec-google: {debug_meta}")
-        except Exception as e:
-            print(f"[weaviate] warning: cannot set gRPC metadata headers: {e}")
 
-    return client
+def _client_alive(client) -> bool:
+    try:
+        return bool(client.is_connected())
+    except Exception:
+        return False
+
+
+def _client_stale(client) -> bool:
+    # Da ricreare se manca, se il canale è chiuso/rotto o se il refresher ha
+    # pubblicato un token Vertex diverso da quello usato alla connessione
+    return (
+        client is None
+        or _CLIENT_VERTEX_TOKEN != _VERTEX_TOKEN
+        or not _client_alive(client)
+    )
 
 
-def _update_client_grpc_metadata(client):
+def _get_client():
     """
-    Aggiorna i metadata gRPC del client con le credenziali Vertex più recenti.
-    Segue lo stesso pattern di _connect() per text2vec-google.
+    Restituisce il client Weaviate condiviso, creandolo alla prima chiamata.
+    Viene ricreato se il canale risulta chiuso/rotto o se il token Vertex è
+    cambiato. Di norma la ricostruzione per un nuovo token la fa già il
+    refresher in background (vedi _refresh_vertex_oauth_loop), quindi le
+    richieste non pagano la connessione.
     """
+    client = _CLIENT
+    if not _client_stale(client):
+        return client
+    return _reconnect_client()
+
+
+def _reconnect_client():
+    global _CLIENT, _CLIENT_VERTEX_TOKEN
+    with _CLIENT_LOCK:
+        old = _CLIENT
+        if not _client_stale(old):
+            return old
+        client, token = _connect()
+        # Prima pubblichiamo il nuovo client, poi ritiriamo il vecchio
+        _CLIENT, _CLIENT_VERTEX_TOKEN = client, token
+    if old is not None:
+        _retire_client(old)
+    return client
+
+
+def _close_quietly(client) -> None:
     try:
-        # Assicuriamoci che _VERTEX_HEADERS contenga il token più recente
-        if not ("_VERTEX_HEADERS" in globals() and _VERTEX_HEADERS and _VERTEX_HEADERS.get("X-Goog-Vertex-Api-Key")):
-            # Se _VERTEX_HEADERS è vuoto o non contiene il token, facciamo un refresh
-            if not _sync_refresh_vertex_token():
-                return
-        
-        # Prendi il token da _VERTEX_HEADERS
-        vertex_token = None
-        if "_VERTEX_HEADERS" in globals() and _VERTEX_HEADERS:
-            vertex_token = _VERTEX_HEADERS.get("X-Goog-Vertex-Api-Key")
-        
-        if not vertex_token:
-            return
-        
-        # Aggiorna i metadata gRPC del client (come nel codice di esempio)
-        conn = getattr(client, "_connection", None)
-        if conn is not None:
-            meta_list = [
-                ("x-goog-vertex-api-key", vertex_token),
-            ]
-            project_id = _VERTEX_USER_PROJECT or _discover_gcp_project()
-            if project_id:
-                meta_list.append(("x-goog-user-project", project_id))
-            
-            # Prova a settare vari modalità (come nel codice di esempio)
-            try:
-                setattr(conn, "grpc_metadata", meta_list)
-            except Exception:
-                pass
-            try:
-                setattr(conn, "_grpc_metadata", meta_list)
-            except Exception:
-                pass
-            if hasattr(conn, "set_grpc_metadata"):
-                try:
-                    conn.set_grpc_metadata(meta_list)
-                except Exception:
-                    pass
-            
-            # Aggiorna anche le variabili d'ambiente per Weaviate vectorizer
-            os.environ["GOOGLE_APIKEY"] = vertex_token
-            os.environ["PALM_APIKEY"] = vertex_token
-    except Exception as e:
-        print(f"[vertex-oauth] warning: cannot update gRPC metadata: {e}")
+        client.close()
+    except Exception:
+        pass
+
+
+def _retire_client(client) -> None:
+    # I thread del pool possono avere ancora query in corso sul vecchio client:
+    # lo chiudiamo solo dopo un intervallo più lungo del timeout delle query
+    timer = threading.Timer(_CLIENT_RETIRE_GRACE_S, _close_quietly, args=(client,))
+    timer.daemon = True
+    timer.start()
+
+
+def _close_client():
+    global _CLIENT
+    client, _CLIENT = _CLIENT, None
+    if client is not None:
+        _close_quietly(client)
+
+
+atexit.register(_close_client)
+
+
+@lru_cache(maxsize=8)
+def _read_text_file(path: str, mtime_ns: int) -> str:
+    # mtime_ns fa parte della chiave di cache: il file viene riletto solo se cambia
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8").strip()
 
 
 def _load_text_source(env_keys, file_path):
@@ -337,8 +469,7 @@ def _load_text_source(env_keys, file_path):
     path = Path(file_path) if file_path else None
     if path and path.exists():
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                return f.read().strip()
+            return _read_text_file(str(path), os.stat(path).st_mtime_ns)
         except Exception as exc:
             print(f"[mcp] warning: cannot read instructions file '{path}': {exc}")
     for key in env_keys:
@@ -385,6 +516,8 @@ else:
     allowed_hosts.append("weaviate-text2vec-mcp.onrender.com")
     allowed_hosts.append("weaviate-text2vec-mcp.onrender.com:*")
 
+_CORS_ALLOWED_ORIGINS = ["*"]
+
 transport_security = TransportSecuritySettings(
     # Manteniamo la protezione DNS rebinding ma permettiamo il tuo dominio
     enable_dns_rebinding_protection=True,
@@ -486,102 +619,154 @@ def get_config() -> Dict[str, Any]:
     }
 
 
+# Esito dell'ultimo check_connection: (ready, timestamp monotonic)
+_READY_CACHE_TTL = 5.0
+_READY_CACHE: Optional[Tuple[bool, float]] = None
+
+
 @mcp.tool()
 def check_connection() -> Dict[str, Any]:
-    client = _connect()
-    try:
-        ready = client.is_ready()
-        return {"ready": bool(ready)}
-    finally:
-        client.close()
+    global _READY_CACHE
+    cached = _READY_CACHE
+    if cached is not None and time.monotonic() - cached[1] < _READY_CACHE_TTL:
+        return {"ready": cached[0]}
+
+    client = _get_client()
+    ready = bool(client.is_ready())
+    _READY_CACHE = (ready, time.monotonic())
+    return {"ready": ready}
+
+
+# Cache dell'elenco collection: lo schema cambia raramente
+_COLLECTIONS_CACHE_TTL = float(os.environ.get("COLLECTIONS_CACHE_TTL", "60"))
+_COLLECTIONS_CACHE: Optional[Tuple[List[str], float]] = None
 
 
 @mcp.tool()
 def list_collections() -> List[str]:
-    client = _connect()
-    try:
-        colls = client.collections.list_all()
-        if isinstance(colls, dict):
-            names = list(colls.keys())
-        else:
-            try:
-                names = [getattr(c, "name", str(c)) for c in colls]
-            except Exception:
-                names = list(colls)
-        return sorted(set(names))
-    finally:
-        client.close()
+    global _COLLECTIONS_CACHE
+    cached = _COLLECTIONS_CACHE
+    if cached is not None and time.monotonic() - cached[1] < _COLLECTIONS_CACHE_TTL:
+        return cached[0]
+
+    client = _get_client()
+    colls = client.collections.list_all()
+    if isinstance(colls, dict):
+        names = list(colls)
+    else:
+        try:
+            names = [getattr(c, "name", str(c)) for c in colls]
+        except Exception:
+            names = list(colls)
+    # dedup mantenendo l'ordine restituito da Weaviate
+    names = list(dict.fromkeys(names))
+    _COLLECTIONS_CACHE = (names, time.monotonic())
+    return names
+
+
+@mcp.tool()
+def invalidate_list_collections() -> Dict[str, Any]:
+    """Svuota la cache di list_collections (es. dopo aver creato una collection)."""
+    global _COLLECTIONS_CACHE
+    _COLLECTIONS_CACHE = None
+    return {"invalidated": True}
 
 
 @mcp.tool()
-def get_schema(collection: str) -> Dict[str, Any]:
-    client = _connect()
+def get_schema(collection: str, client: Optional[Any] = None) -> Dict[str, Any]:
+    client = client or _get_client()
+    coll = client.collections.get(collection)
+    if coll is None:
+        return {"error": f"Collection '{collection}' not found"}
     try:
-        coll = client.collections.get(collection)
-        if coll is None:
-            return {"error": f"Collection '{collection}' not found"}
+        cfg = coll.config.get()
+    except Exception:
         try:
-            cfg = coll.config.get()
+            cfg = coll.config.get_class()
         except Exception:
-            try:
-                cfg = coll.config.get_class()
-            except Exception:
-                cfg = {"info": "config API not available in this client version"}
-        return {"collection": collection, "config": cfg}
-    finally:
-        client.close()
+            cfg = {"info": "config API not available in this client version"}
+    return {"collection": collection, "config": cfg}
+
+
+_get_object_fields = attrgetter("uuid", "properties", "metadata")
+_get_score_distance = attrgetter("score", "distance")
+
+
+def _materialize(
+    resp,
+    with_score: bool = False,
+    with_distance: bool = False,
+    log_label: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Converte gli oggetti di una risposta Weaviate in righe serializzabili,
+    attraversando resp.objects una sola volta. with_score/with_distance
+    aggiungono "bm25_score" e "distance" presi dai metadata dell'oggetto.
+    Se log_label è valorizzato logga (livello DEBUG) anche fileName e score
+    di ogni oggetto (formato Colab).
+    """
+    if log_label:
+        _SEARCH_LOGGER.debug("Risultati %s:", log_label)
+    out = []
+    for o in getattr(resp, "objects", None) or ():
+        uid, props, md = _get_object_fields(o)
+        # In v4 i metadata sono un dataclass con score/distance sempre presenti
+        try:
+            score, distance = _get_score_distance(md)
+        except AttributeError:
+            score = distance = None
+        row = {"uuid": str(uid), "properties": props}
+        if with_score:
+            row["bm25_score"] = score
+        if with_distance:
+            row["distance"] = distance
+        if log_label:
+            file_name = props.get("fileName", "N/A")
+            if score is not None:
+                _SEARCH_LOGGER.debug("%s  score=%.4f", file_name, score)
+            else:
+                _SEARCH_LOGGER.debug("%s  score=N/A", file_name)
+        out.append(row)
+    return out
 
 
 @mcp.tool()
-def keyword_search(collection: str, query: str, limit: int = 10) -> Dict[str, Any]:
-    client = _connect()
-    try:
-        coll = client.collections.get(collection)
-        if coll is None:
-            return {"error": f"Collection '{collection}' not found"}
-        resp = coll.query.bm25(
-            query=query,
-            return_metadata=MetadataQuery(score=True),
-            limit=limit,
-        )
-        out = []
-        for o in getattr(resp, "objects", []) or []:
-            out.append(
-                {
-                    "uuid": str(getattr(o, "uuid", "")),
-                    "properties": getattr(o, "properties", {}),
-                    "bm25_score": getattr(getattr(o, "metadata", None), "score", None),
-                }
-            )
-        return {"count": len(out), "results": out}
-    finally:
-        client.close()
+def keyword_search(
+    collection: str, query: str, limit: int = 10, client: Optional[Any] = None
+) -> Dict[str, Any]:
+    client = client or _get_client()
+    coll = client.collections.get(collection)
+    if coll is None:
+        return {"error": f"Collection '{collection}' not found"}
+    resp = coll.query.bm25(
+        query=query,
+        return_metadata=MetadataQuery(score=True),
+        limit=limit,
+    )
+    out = _materialize(resp, with_score=True)
+    return {"count": len(out), "results": out}
 
 
 @mcp.tool()
-def semantic_search(collection: str, query: str, limit: int = 10) -> Dict[str, Any]:
-    client = _connect()
-    try:
-        coll = client.collections.get(collection)
-        if coll is None:
-            return {"error": f"Collection '{collection}' not found"}
-        resp = coll.query.near_text(
-            query=query,
-            limit=limit,
-            return_metadata=MetadataQuery(distance=True),
-        )
-        out = []
-        for o in getattr(resp, "objects", []) or []:
-            out.append(
-                {
-                    "uuid": str(getattr(o, "uuid", "")),
-                    "properties": getattr(o, "properties", {}),
-                    "distance": getattr(getattr(o, "metadata", None), "distance", None),
-                }
-            )
-        return {"count": len(out), "results": out}
-    finally:
-        client.close()
+def semantic_search(
+    collection: str, query: str, limit: int = 10, client: Optional[Any] = None
+) -> Dict[str, Any]:
+    client = client or _get_client()
+    coll = client.collections.get(collection)
+    if coll is None:
+        return {"error": f"Collection '{collection}' not found"}
+    resp = coll.query.near_text(
+        query=query,
+        limit=limit,
+        return_metadata=MetadataQuery(distance=True),
+    )
+    out = _materialize(resp, with_distance=True)
+    return {"count": len(out), "results": out}
+
+
+# Costanti di hybrid_search, allocate una sola volta
+_HYBRID_RETURN_PROPS = ["text", "sourceId", "fileName", "fileType", "pageIndex", "chunkIndex", "url"]
+_HYBRID_META = MetadataQuery(score=True, distance=True)
 
 
 @mcp.tool()
@@ -591,10 +776,12 @@ def hybrid_search(
     limit: int = 10,
     alpha: float = 0.2,
     query_properties: Optional[Any] = None,
+    client: Optional[Any] = None,
 ) -> Dict[str, Any]:
     if collection and collection != "WindChunk":
-        print(
-            f"[hybrid_search] warning: collection '{collection}' requested, but using 'WindChunk' as per instructions"
+        _SEARCH_LOGGER.warning(
+            "collection '%s' requested, but using 'WindChunk' as per instructions",
+            collection,
         )
         collection = "WindChunk"
 
@@ -604,63 +791,38 @@ def hybrid_search(
         except (json.JSONDecodeError, TypeError):
             pass
 
-    client = _connect()
-    try:
-        coll = client.collections.get(collection)
-        if coll is None:
-            return {"error": f"Collection '{collection}' not found"}
-
-        # Aggiorna i metadata gRPC prima della query per assicurarci che siano aggiornati
-        _update_client_grpc_metadata(client)
-
-        hybrid_params = {
-            "query": query,
-            "alpha": alpha,
-            "limit": limit,
-            "return_properties": ["text", "sourceId", "fileName", "fileType", "pageIndex", "chunkIndex", "url"],
-            "return_metadata": MetadataQuery(score=True, distance=True),
-        }
-        if query_properties:
-            hybrid_params["query_properties"] = query_properties
-        resp = coll.query.hybrid(**hybrid_params)
-
-        # Log dei risultati nel formato Colab
-        print("[DEBUG] Risultati hybrid search:")
-        for o in getattr(resp, "objects", []) or []:
-            fileName = getattr(o, "properties", {}).get("fileName", "N/A")
-            md = getattr(o, "metadata", None)
-            score = getattr(md, "score", None)
-            if score is not None:
-                print(f"{fileName}  score={score:.4f}")
-            else:
-                print(f"{fileName}  score=N/A")
-
-        out = []
-        for o in getattr(resp, "objects", []) or []:
-            md = getattr(o, "metadata", None)
-            score = getattr(md, "score", None)
-            distance = getattr(md, "distance", None)
-            out.append(
-                {
-                    "uuid": str(getattr(o, "uuid", "")),
-                    "properties": getattr(o, "properties", {}),
-                    "bm25_score": score,
-                    "distance": distance,
-                }
-            )
-        return {"count": len(out), "results": out}
-    finally:
-        client.close()
+    client = client or _get_client()
+    coll = client.collections.get(collection)
+    if coll is None:
+        return {"error": f"Collection '{collection}' not found"}
+
+    resp = coll.query.hybrid(
+        query=query,
+        alpha=alpha,
+        limit=limit,
+        query_properties=query_properties or None,
+        return_properties=_HYBRID_RETURN_PROPS,
+        return_metadata=_HYBRID_META,
+    )
+
+    out = _materialize(
+        resp,
+        with_score=True,
+        with_distance=True,
+        log_label="hybrid search" if _SEARCH_LOGGER.isEnabledFor(logging.DEBUG) else None,
+    )
+    return {"count": len(out), "results": out}
 
 
 def _ensure_gcp_adc():
     gac_json = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS_JSON")
     gac_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
     if gac_json and not gac_path:
-        tmp_path = "/app/gcp_credentials.json"
+        tmp_path = _ADC_JSON_PATH
         with open(tmp_path, "w", encoding="utf-8") as f2:
             f2.write(gac_json)
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = tmp_path
+        _resolve_service_account_path_cached.cache_clear()
     _resolve_service_account_path()
     if os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"):
         _load_vertex_user_project(os.environ["GOOGLE_APPLICATION_CREDENTIALS"])
@@ -670,34 +832,45 @@ def _ensure_gcp_adc():
 def diagnose_vertex() -> Dict[str, Any]:
     info: Dict[str, Any] = {}
     info["project_id"] = _discover_gcp_project()
-    info["oauth_enabled"] = os.environ.get("VERTEX_USE_OAUTH", "").lower() in (
-        "1",
-        "true",
-        "yes",
-    )
-    info["headers_active"] = bool(_VERTEX_HEADERS) if "_VERTEX_HEADERS" in globals() else False
+    info["oauth_enabled"] = _VERTEX_REFRESH_THREAD_STARTED
+    info["headers_active"] = bool(_VERTEX_HEADERS)
     try:
-        from google.oauth2 import service_account
-        from google.auth.transport.requests import Request
-
-        SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
-        gac_path = _resolve_service_account_path()
-        token_preview = None
-        expiry = None
-        if gac_path and os.path.exists(gac_path):
-            creds = service_account.Credentials.from_service_account_file(
-                gac_path, scopes=SCOPES
-            )
-            creds.refresh(Request())
-            token_preview = (creds.token[:12] + "...") if creds.token else None
-            expiry = getattr(creds, "expiry", None)
-        info["token_sample"] = token_preview
-        info["token_expiry"] = str(expiry) if expiry else None
+        # Usa il token in cache; il refresh avviene solo se manca o è in scadenza
+        if not _vertex_token_valid():
+            _sync_refresh_vertex_token()
+        token = _VERTEX_TOKEN
+        info["token_sample"] = (token[:12] + "...") if token else None
+        info["token_expiry"] = str(_VERTEX_TOKEN_EXPIRY) if _VERTEX_TOKEN_EXPIRY else None
     except Exception as e:
         info["token_error"] = str(e)
     return info
 
 
+@mcp.tool()
+def reload_credentials() -> Dict[str, Any]:
+    """
+    Invalida le cache di service account, project_id e token Vertex
+    (da usare dopo aver ruotato il file della service account).
+    Il nuovo token fa ricreare il client Weaviate alla prossima chiamata.
+    """
+    global _VERTEX_USER_PROJECT, _VERTEX_SA_CREDS, _VERTEX_SA_CREDS_PATH
+    global _VERTEX_TOKEN_EXPIRY
+    with _VERTEX_REFRESH_LOCK:
+        _discover_gcp_project.cache_clear()
+        _load_service_account_info.cache_clear()
+        _resolve_service_account_path_cached.cache_clear()
+        _VERTEX_USER_PROJECT = None
+        _VERTEX_SA_CREDS = None
+        _VERTEX_SA_CREDS_PATH = None
+        _VERTEX_TOKEN_EXPIRY = None
+    sa_path, project_id = _resolve_service_account_path_cached()
+    return {
+        "service_account_path": sa_path,
+        "project_id": project_id or _discover_gcp_project(),
+        "token_refreshed": _sync_refresh_vertex_token(),
+    }
+
+
 # Registry dei tool normali che vuoi esporre alla App
 TOOL_REGISTRY: Dict[str, Any] = {
     "ping": ping,
@@ -706,11 +879,13 @@ TOOL_REGISTRY: Dict[str, Any] = {
     "get_config": get_config,
     "check_connection": check_connection,
     "list_collections": list_collections,
+    "invalidate_list_collections": invalidate_list_collections,
     "get_schema": get_schema,
     "keyword_search": keyword_search,
     "semantic_search": semantic_search,
     "hybrid_search": hybrid_search,
     "diagnose_vertex": diagnose_vertex,
+    "reload_credentials": reload_credentials,
 }
 
 # Tool nascosti (non esposti all'LLM ma ancora disponibili internamente)
@@ -719,281 +894,608 @@ _HIDDEN_TOOLS: set[str] = {
     "keyword_search",
     "diagnose_vertex",
     "list_collections",
+    "invalidate_list_collections",
     "get_schema",
     # "get_instructions",  # RIMOSSO: deve essere visibile per debug
     "reload_instructions",
+    "reload_credentials",
     "get_config",
     "check_connection",
 }
 
 
-# ==== Vertex OAuth Token Refresher (optional) ===============================
+def _wrap_result_in_dict(fn, is_coro: bool):
+    """
+    Avvolge un tool che non restituisce un dict, così il dispatcher riceve
+    sempre un oggetto utilizzabile direttamente come structuredContent.
+    """
+    if is_coro:
+
+        @wraps(fn)
+        async def async_inner(**kwargs):
+            r = await fn(**kwargs)
+            return r if isinstance(r, dict) else {"result": r}
+
+        return async_inner
+
+    @wraps(fn)
+    def inner(**kwargs):
+        r = fn(**kwargs)
+        return r if isinstance(r, dict) else {"result": r}
+
+    return inner
+
+
+def _build_tool_meta(name: str, fn) -> Dict[str, Any]:
+    """
+    Precalcola (una volta, alla registrazione) come invocare un tool:
+    quali argomenti accetta, se è una coroutine, se riceve il client Weaviate
+    condiviso (parametro "client") e se il risultato va avvolto in un dict.
+    Prepara anche l'intestazione del testo di risposta.
+    """
+    sig = inspect.signature(fn)
+    params = sig.parameters
+    is_coro = inspect.iscoroutinefunction(fn)
+    returns_dict = sig.return_annotation is dict or get_origin(sig.return_annotation) is dict
+    return {
+        "fn": fn if returns_dict else _wrap_result_in_dict(fn, is_coro),
+        "is_coro": is_coro,
+        # "client" è iniettato dal dispatcher, mai preso dagli argomenti MCP
+        "params": frozenset(params) - {"client"},
+        "needs_client": "client" in params,
+        "accepts_var_kw": any(
+            p.kind is inspect.Parameter.VAR_KEYWORD for p in params.values()
+        ),
+        "text_prefix": f"Risultato del tool {name} in formato strutturato (JSON leggibile):\n\n",
+    }
+
+
+_TOOL_META: Dict[str, Dict[str, Any]] = {
+    name: _build_tool_meta(name, fn) for name, fn in TOOL_REGISTRY.items()
+}
+
+
+# ==== Vertex OAuth Token Refresher ==========================================
 def _write_adc_from_json_env():
     gac_json = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS_JSON")
     gac_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
     if gac_json and not gac_path:
-        tmp_path = "/app/gcp_credentials.json"
+        tmp_path = _ADC_JSON_PATH
         with open(tmp_path, "w", encoding="utf-8") as f2:
             f2.write(gac_json)
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = tmp_path
+        _resolve_service_account_path_cached.cache_clear()
     _resolve_service_account_path()
 
 
 def _refresh_vertex_oauth_loop():
-    from google.oauth2 import service_account
-    from google.auth.transport.requests import Request
-    import datetime
-    import time
-
-    SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
-    cred_path = _resolve_service_account_path()
-    if not cred_path or not os.path.exists(cred_path):
-        print("[vertex-oauth] GOOGLE_APPLICATION_CREDENTIALS missing; token refresher disabled")
-        return
-    creds = service_account.Credentials.from_service_account_file(
-        cred_path, scopes=SCOPES
-    )
-    global _VERTEX_HEADERS
     while True:
-        try:
-            creds.refresh(Request())
-            token = creds.token
-            _VERTEX_HEADERS = _build_vertex_header_map(token)
-            # Aggiorna anche le variabili d'ambiente per Weaviate vectorizer
-            os.environ["GOOGLE_APIKEY"] = token
-            os.environ["PALM_APIKEY"] = token
-            token_preview = token[:10] if token else None
-            print(f"[vertex-oauth] 🔄 Vertex token refreshed (prefix: {token_preview}...)")
-            sleep_s = 55 * 60
-            if creds.expiry:
-                from datetime import timezone
-                now = datetime.datetime.now(timezone.utc).replace(tzinfo=creds.expiry.tzinfo)
-                delta = (creds.expiry - now).total_seconds() - 300
-                if delta > 300:
-                    sleep_s = int(delta)
-            time.sleep(sleep_s)
-        except Exception as e:
-            print(f"[vertex-oauth] refresh error: {e}")
-            time.sleep(60)
+        # Dorme fino a 5 minuti prima della scadenza del token corrente;
+        # se non c'è un token valido riprova dopo 60 secondi
+        sleep_s = 60
+        expiry = _VERTEX_TOKEN_EXPIRY
+        if _VERTEX_TOKEN and expiry:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            sleep_s = max(int((expiry - now).total_seconds()) - 300, 60)
+        # wait() ritorna True appena _VERTEX_STOP viene settato (shutdown)
+        if _VERTEX_STOP.wait(sleep_s):
+            return
+        # Passa dallo stesso lock del refresh sincrono: le credenziali sono condivise
+        if _sync_refresh_vertex_token(force=True):
+            # Ricostruisce subito il client con il nuovo token, qui e non
+            # sul percorso delle richieste
+            try:
+                _reconnect_client()
+            except Exception as e:
+                _WEAVIATE_LOGGER.warning("reconnect after token refresh failed: %s", e)
 
 
 def _maybe_start_vertex_oauth_refresher():
     global _VERTEX_REFRESH_THREAD_STARTED
     if _VERTEX_REFRESH_THREAD_STARTED:
         return
-    if os.environ.get("VERTEX_USE_OAUTH", "").lower() not in ("1", "true", "yes"):
+    # Con una chiave statica/bearer non c'è nessun token OAuth da ruotare
+    if os.environ.get("VERTEX_APIKEY") or os.environ.get("VERTEX_BEARER_TOKEN"):
         return
     _write_adc_from_json_env()
     sa_path = _resolve_service_account_path()
     if not sa_path:
-        print("[vertex-oauth] service account path not found; refresher not started")
+        _VERTEX_LOGGER.info("service account path not found; refresher not started")
         return
-    import threading
+
+    # Primo refresh bloccante: la prima richiesta trova già il token pronto
+    if not _sync_refresh_vertex_token(force=True):
+        _VERTEX_LOGGER.warning("initial Vertex token refresh failed, retrying in background")
 
     t = threading.Thread(target=_refresh_vertex_oauth_loop, daemon=True)
     t.start()
+    atexit.register(_VERTEX_STOP.set)
     _VERTEX_REFRESH_THREAD_STARTED = True
 
 
-_maybe_start_vertex_oauth_refresher()
-
-# --- Alias /mcp senza slash finale, se serve --------------------------------
-try:
-    from starlette.routing import Route
+def _bootstrap():
+    """
+    Apre subito il client Weaviate condiviso (HTTP + canale gRPC), così la
+    prima richiesta non paga la latenza di connessione. Se Weaviate non è
+    raggiungibile all'avvio resta il fallback lazy di _get_client().
+    Se il token Vertex non è ancora disponibile, _get_client() ricrea il
+    client appena il refresher ne ottiene uno.
+    """
+    try:
+        _get_client()
+        _WEAVIATE_LOGGER.info("shared client connected at startup")
+    except Exception as e:
+        _WEAVIATE_LOGGER.warning("eager connection failed, will retry on first request: %s", e)
 
-    _starlette_app = getattr(mcp, "app", None) or getattr(mcp, "_app", None)
 
-    if _starlette_app is not None:
+def _startup():
+    # Token Vertex (bloccante) e client Weaviate: solo nel processo che serve
+    # le richieste, non a ogni import di serve.py (supervisor/spawn di uvicorn).
+    # Un errore qui non deve impedire l'avvio del server.
+    try:
+        _maybe_start_vertex_oauth_refresher()
+    except Exception as e:
+        _VERTEX_LOGGER.warning("cannot start Vertex OAuth refresher: %s", e)
+    _bootstrap()
 
-        async def _mcp_alias(request):
-            scope = dict(request.scope)
-            scope["path"] = "/mcp/"
-            scope["raw_path"] = b"/mcp/"
-            return await _starlette_app(scope, request.receive, request.send)
+# --- Alias /mcp con e senza slash finale -------------------------------------
+class _MCPPathAlias:
+    """
+    Middleware ASGI minimale: riscrive /mcp e /mcp/ sul path effettivo
+    dell'endpoint MCP modificando lo scope in place (nessuna copia per richiesta,
+    nessun redirect per lo slash finale).
+    """
 
-        _starlette_app.router.routes.insert(
-            0,
-            Route(
-                "/mcp",
-                endpoint=_mcp_alias,
-                methods=["GET", "HEAD", "POST", "OPTIONS"],
+    def __init__(self, app, target: str):
+        self.app = app
+        self.target = target
+        self.raw_target = target.encode()
+        base = target.rstrip("/")
+        self.aliases = frozenset({base, base + "/"}) - {target}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.aliases:
+            scope["path"] = self.target
+            scope["raw_path"] = self.raw_target
+        await self.app(scope, receive, send)
+
+
+# Numero massimo di query per una singola chiamata batch a hybrid_search
+_HYBRID_BATCH_MAX = int(os.environ.get("HYBRID_BATCH_MAX", "32"))
+
+# ✅ Schema specifico per hybrid_search con istruzioni incluse
+_HYBRID_TOOL_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "collection": {
+            "type": "string",
+            "description": "Lascia vuoto oppure usa il valore predefinito per cercare nella documentazione WindBilance.",
+        },
+        "query": {
+            "anyOf": [
+                {"type": "string"},
+                {"type": "array", "items": {"type": "string"}, "maxItems": _HYBRID_BATCH_MAX},
+            ],
+            "description": (
+                "Testo della domanda o delle parole chiave da cercare nei manuali WindBilance. "
+                "Per più formulazioni della stessa domanda passa una lista: le ricerche vengono eseguite in parallelo."
             ),
-        )
-except Exception as _route_err:
-    print("[mcp] warning: cannot register MCP alias route:", _route_err)
+        },
+        "limit": {
+            "type": "integer",
+            "description": "Numero massimo di risultati da usare come base per la risposta.",
+            "default": 10,
+        },
+        "alpha": {
+            "type": "number",
+            "description": "Parametro interno di ricerca (lascia il valore predefinito salvo casi particolari).",
+            "default": 0.8,
+        },
+        "query_properties": {
+            "type": "array",
+            "items": {"type": "string"},
+            "description": "Campi testuali interni su cui cercare (di solito non serve modificarli).",
+        },
+    },
+    "required": ["query"],
+    "additionalProperties": False,
+}
+
+
+# Schema di default: argomenti liberi
+_DEFAULT_TOOL_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {},
+    "required": [],
+    "additionalProperties": True,
+}
+_DEFAULT_TOOL_ANNOTATIONS = types.ToolAnnotations(
+    destructiveHint=False,
+    openWorldHint=True,
+    readOnlyHint=False,
+)
+
+
+# Tool con metadati specifici (titolo, descrizione, schema): costanti di modulo
+_HYBRID_SEARCH_TOOL = types.Tool(
+    name="hybrid_search",
+    title="Ricerca nella documentazione WindBilance",
+    description=(
+        "Usa questo tool per cercare nei manuali e nella documentazione tecnica WindBilance. "
+        "È il modo principale per trovare informazioni su uso, installazione, errori, manutenzione e calibrazione "
+        "delle bilance e dei terminali WindBilance. "
+        "Prima esegui una ricerca con questo tool, poi costruisci la risposta usando i manuali trovati."
+    ),
+    inputSchema=_HYBRID_TOOL_SCHEMA,
+    annotations=_DEFAULT_TOOL_ANNOTATIONS,
+)
+_CUSTOM_TOOLS: Dict[str, types.Tool] = {"hybrid_search": _HYBRID_SEARCH_TOOL}
+
+
+def _default_tool(name: str) -> types.Tool:
+    return types.Tool(
+        name=name,
+        title=name,
+        description=name,
+        inputSchema=_DEFAULT_TOOL_SCHEMA,
+        annotations=_DEFAULT_TOOL_ANNOTATIONS,
+    )
+
+
+def _build_tool_list() -> Tuple[types.Tool, ...]:
+    # Tutti i tool normali (escludendo quelli nascosti), nell'ordine del registry
+    return tuple(
+        _CUSTOM_TOOLS.get(name) or _default_tool(name)
+        for name in TOOL_REGISTRY
+        if name not in _HIDDEN_TOOLS
+    )
+
+
+# Registry e schema sono statici: i tool vengono costruiti una volta sola e
+# tenuti in una tupla immutabile (ricostruire con _build_tool_list() solo se
+# TOOL_REGISTRY o _HIDDEN_TOOLS cambiano)
+_CACHED_TOOLS: Tuple[types.Tool, ...] = _build_tool_list()
+
 
 @mcp._mcp_server.list_tools()
 async def _list_tools() -> List[types.Tool]:
     """Espone tutti i tool normali a ChatGPT."""
-    tools: List[types.Tool] = []
-
-    # Tutti i tool normali (escludendo quelli nascosti)
-    for name in TOOL_REGISTRY.keys():
-        # Salta i tool nascosti
-        if name in _HIDDEN_TOOLS:
-            continue
-        # Schema di default: argomenti liberi
-        input_schema: Dict[str, Any] = {
-            "type": "object",
-            "properties": {},
-            "required": [],
-            "additionalProperties": True,
-        }
-
-        tool_title = name
-        tool_description = name
-        annotations = {
-            "destructiveHint": False,
-            "openWorldHint": True,
-            "readOnlyHint": False,
-        }
-
-        # ✅ Schema specifico per hybrid_search con istruzioni incluse
-        if name == "hybrid_search":
-            input_schema = {
-                "type": "object",
-                "properties": {
-                    "collection": {
-                        "type": "string",
-                        "description": "Lascia vuoto oppure usa il valore predefinito per cercare nella documentazione WindBilance.",
-                    },
-                    "query": {
-                        "type": "string",
-                        "description": "Testo della domanda o delle parole chiave da cercare nei manuali WindBilance.",
-                    },
-                    "limit": {
-                        "type": "integer",
-                        "description": "Numero massimo di risultati da usare come base per la risposta.",
-                        "default": 10,
-                    },
-                    "alpha": {
-                        "type": "number",
-                        "description": "Parametro interno di ricerca (lascia il valore predefinito salvo casi particolari).",
-                        "default": 0.8,
-                    },
-                    "query_properties": {
-                        "type": "array",
-                        "items": {"type": "string"},
-                        "description": "Campi testuali interni su cui cercare (di solito non serve modificarli).",
-                    },
-                },
-                "required": ["query"],
-                "additionalProperties": False,
-            }
-            tool_title = "Ricerca nella documentazione WindBilance"
-            tool_description = (
-                "Usa questo tool per cercare nei manuali e nella documentazione tecnica WindBilance. "
-                "È il modo principale per trovare informazioni su uso, installazione, errori, manutenzione e calibrazione "
-                "delle bilance e dei terminali WindBilance. "
-                "Prima esegui una ricerca con questo tool, poi costruisci la risposta usando i manuali trovati."
-            )
+    return list(_CACHED_TOOLS)
 
-        tools.append(
-            types.Tool(
-                name=name,
-                title=tool_title,
-                description=tool_description,
-                inputSchema=input_schema,
-                annotations=annotations,
-            )
-        )
 
-    return tools
+# Nessuna risorsa esposta: liste vuote condivise (non vengono mai modificate)
+_EMPTY_RESOURCES: List[types.Resource] = []
+_EMPTY_TEMPLATES: List[types.ResourceTemplate] = []
 
 
 @mcp._mcp_server.list_resources()
 async def _list_resources() -> List[types.Resource]:
-    return []
+    return _EMPTY_RESOURCES
 
 
 @mcp._mcp_server.list_resource_templates()
 async def _list_resource_templates() -> List[types.ResourceTemplate]:
-    return []
+    return _EMPTY_TEMPLATES
 
 
-async def _handle_read_resource(req: types.ReadResourceRequest) -> types.ServerResult:
+@lru_cache(maxsize=256)
+def _unknown_resource(uri: str) -> types.ServerResult:
     return types.ServerResult(
         types.ReadResourceResult(
             contents=[],
-            _meta={"error": f"Unknown resource: {req.params.uri}"},
+            _meta={"error": f"Unknown resource: {uri}"},
+        )
+    )
+
+
+async def _handle_read_resource(req: types.ReadResourceRequest) -> types.ServerResult:
+    return _unknown_resource(str(req.params.uri))
+
+
+# Parametri opzionali di hybrid_search accettati dal client
+_HYBRID_ALLOWED = frozenset({"limit", "alpha", "query_properties"})
+
+_HYBRID_MISSING_QUERY_RESULT = types.ServerResult(
+    types.CallToolResult(
+        content=[
+            types.TextContent(
+                type="text",
+                text="Errore: parametro obbligatorio 'query' mancante per hybrid_search.",
+            )
+        ],
+        isError=True,
+    )
+)
+
+
+_HYBRID_BATCH_TOO_LARGE_RESULT = types.ServerResult(
+    types.CallToolResult(
+        content=[
+            types.TextContent(
+                type="text",
+                text=f"Errore: al massimo {_HYBRID_BATCH_MAX} query per chiamata a hybrid_search.",
+            )
+        ],
+        isError=True,
+    )
+)
+
+_HYBRID_INVALID_BATCH_RESULT = types.ServerResult(
+    types.CallToolResult(
+        content=[
+            types.TextContent(
+                type="text",
+                text="Errore: in hybrid_search ogni elemento di 'query' deve essere una stringa non vuota.",
+            )
+        ],
+        isError=True,
+    )
+)
+
+# Limite del testo di risposta (structuredContent resta completo)
+_TEXT_MAX_CHARS = 6000
+_TEXT_TRUNCATED_SUFFIX = (
+    "\n\n[Output troncato per lunghezza. I dati completi sono in structuredContent.]"
+)
+
+# Pool per i tool sincroni: le chiamate a Weaviate girano fuori dall'event loop,
+# così più richieste MCP concorrenti sovrappongono il loro I/O
+_TOOL_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("MCP_TOOL_WORKERS", "16")),
+    thread_name_prefix="mcp-tool",
+)
+
+
+# Allo scadere del budget (_TOOL_BUDGET_MS) la risposta MCP è un errore; un
+# thread del pool già avviato resta occupato fino al timeout della query
+# Weaviate (_WEAVIATE_QUERY_TIMEOUT, per default allineato al budget)
+if (
+    _TOOL_BUDGET_S
+    and os.environ.get("WEAVIATE_QUERY_TIMEOUT")
+    and _WEAVIATE_QUERY_TIMEOUT > _TOOL_BUDGET_S
+):
+    _MCP_LOGGER.warning(
+        "WEAVIATE_QUERY_TIMEOUT (%ss) exceeds MCP_TOOL_BUDGET_MS (%s ms): "
+        "timed-out calls keep pool threads busy until Weaviate gives up",
+        _WEAVIATE_QUERY_TIMEOUT,
+        _TOOL_BUDGET_MS,
+    )
+
+
+@lru_cache(maxsize=128)
+def _budget_exceeded_result(name: str) -> types.ServerResult:
+    return types.ServerResult(
+        types.CallToolResult(
+            content=[
+                types.TextContent(
+                    type="text",
+                    text=f"Tempo massimo superato per il tool {name} ({_TOOL_BUDGET_MS} ms).",
+                )
+            ],
+            isError=True,
         )
     )
 
 
+def _call_with_client(fn, kwargs: Dict[str, Any]) -> Any:
+    # Eseguito nel thread del pool: l'eventuale (ri)connessione non blocca l'event loop
+    return fn(client=_get_client(), **kwargs)
+
+
+async def _invoke_tool(meta: Dict[str, Any], kwargs: Dict[str, Any]) -> Any:
+    fn = meta["fn"]
+    loop = asyncio.get_running_loop()
+    if meta["is_coro"]:
+        if meta["needs_client"]:
+            kwargs = {**kwargs, "client": await loop.run_in_executor(_TOOL_POOL, _get_client)}
+        return await fn(**kwargs)
+    if meta["needs_client"]:
+        return await loop.run_in_executor(_TOOL_POOL, _call_with_client, fn, kwargs)
+    return await loop.run_in_executor(_TOOL_POOL, partial(fn, **kwargs))
+
+
+# Cache dei risultati di hybrid_search: gli agenti ripetono spesso la stessa
+# query nello stesso turno. Usata solo dall'event loop (nessun lock necessario).
+# HYBRID_CACHE_SIZE=0 o HYBRID_CACHE_TTL=0 disabilitano la cache.
+_HS_CACHE_SIZE = int(os.environ.get("HYBRID_CACHE_SIZE", "512"))
+_HS_CACHE_TTL = float(os.environ.get("HYBRID_CACHE_TTL", "60"))
+_HS_CACHE: Optional[TTLCache] = (
+    TTLCache(maxsize=_HS_CACHE_SIZE, ttl=_HS_CACHE_TTL)
+    if _HS_CACHE_SIZE > 0 and _HS_CACHE_TTL > 0
+    else None
+)
+
+
+def _hybrid_cache_key(args: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+    qp = args.get("query_properties")
+    key = (
+        args.get("collection"),
+        args.get("query"),
+        args.get("alpha"),
+        args.get("limit"),
+        tuple(qp) if isinstance(qp, list) else qp,
+    )
+    try:
+        hash(key)
+    except TypeError:
+        # argomenti non hashable (es. tipi inattesi dal client): niente cache
+        return None
+    return key
+
+
+async def _run_hybrid(meta: Dict[str, Any], args: Dict[str, Any]) -> Dict[str, Any]:
+    key = _hybrid_cache_key(args) if _HS_CACHE is not None else None
+    if key is not None:
+        cached = _HS_CACHE.get(key)
+        if cached is not None:
+            return cached
+    result = await _invoke_tool(meta, args)
+    if key is not None and "error" not in result:
+        _HS_CACHE[key] = result
+    return result
+
+
+_ProgressSender = Callable[[int, int, Dict[str, Any]], Awaitable[None]]
+
+
+async def _run_hybrid_batch(
+    meta: Dict[str, Any],
+    args: Dict[str, Any],
+    queries: List[str],
+    progress: Optional[_ProgressSender] = None,
+) -> Dict[str, Any]:
+    """
+    Esegue hybrid_search per più query in parallelo (una chiamata MCP invece
+    di N) e restituisce i risultati nello stesso ordine delle query.
+    Le query duplicate vengono eseguite una sola volta.
+    Se `progress` è dato, ogni risultato viene inviato appena pronto.
+    """
+    unique = list(dict.fromkeys(queries))
+    total = len(unique)
+    done = 0
+
+    async def _one(q: str) -> Dict[str, Any]:
+        nonlocal done
+        try:
+            item = {"query": q, **(await _run_hybrid(meta, {**args, "query": q}))}
+        except Exception as e:
+            item = {"query": q, "error": str(e)}
+        if progress is not None:
+            done += 1
+            await progress(done, total, item)
+        return item
+
+    items = await asyncio.gather(*(_one(q) for q in unique))
+    by_query = dict(zip(unique, items))
+    out = [by_query[q] for q in queries]
+    return {"count": len(out), "results": out}
+
+
+# Avanzamento delle chiamate batch come notifiche di progresso MCP (solo se
+# abilitato e se il client ha passato un progressToken nella richiesta).
+# Il messaggio è un breve riepilogo; con "full" contiene il risultato completo
+# della query (che arriva comunque anche nella risposta finale).
+_STREAM_PROGRESS_MODE = os.environ.get("MCP_STREAM_PROGRESS", "").lower()
+_STREAM_PROGRESS = _STREAM_PROGRESS_MODE in ("1", "true", "yes", "full")
+_STREAM_PROGRESS_FULL = _STREAM_PROGRESS_MODE == "full"
+
+
+def _progress_message(done: int, total: int, item: Dict[str, Any]) -> str:
+    if _STREAM_PROGRESS_FULL:
+        return _compact_json(item)
+    if "error" in item:
+        return f"{done}/{total} query {item['query']!r}: errore"
+    return f"{done}/{total} query {item['query']!r}: {item.get('count', 0)} risultati"
+
+
+def _progress_sender(req: types.CallToolRequest) -> Optional[_ProgressSender]:
+    if not _STREAM_PROGRESS:
+        return None
+    req_meta = req.params.meta
+    token = req_meta.progressToken if req_meta is not None else None
+    if token is None:
+        return None
+    try:
+        ctx = mcp._mcp_server.request_context
+    except LookupError:
+        return None
+
+    async def _send(done: int, total: int, item: Dict[str, Any]) -> None:
+        try:
+            await ctx.session.send_progress_notification(
+                token,
+                done,
+                total=total,
+                message=_progress_message(done, total, item),
+                related_request_id=ctx.request_id,
+            )
+        except Exception as e:
+            # il risultato finale arriva comunque: il progresso è best-effort
+            _MCP_LOGGER.warning("progress notification failed: %s", e)
+
+    return _send
+
+
+@lru_cache(maxsize=128)
+def _unknown_tool_result(name: str) -> types.ServerResult:
+    return types.ServerResult(
+        types.CallToolResult(
+            content=[
+                types.TextContent(
+                    type="text",
+                    text=f"Unknown tool: {name}",
+                )
+            ],
+            isError=True,
+        )
+    )
+
+
+def _compact_json(obj: Any) -> str:
+    # Serializzazione compatta per log di debug e notifiche (orjson, UTF-8 nativo)
+    try:
+        return orjson.dumps(obj, default=str).decode()
+    except Exception:
+        return repr(obj)
+
+
 async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
     name = req.params.name
     args = req.params.arguments or {}
 
-    # LOG DI DEBUG: vediamo quali tool vengono chiamati
-    print(f"[call_tool] name={name}, args={json.dumps(args, ensure_ascii=False)}")
+    # LOG DI DEBUG: vediamo quali tool vengono chiamati (formattato solo se DEBUG è attivo)
+    if _MCP_LOGGER.isEnabledFor(logging.DEBUG):
+        _MCP_LOGGER.debug("call_tool name=%s args=%s", name, _compact_json(args))
 
     # Tool normali (quelli del registry)
-    if name in TOOL_REGISTRY:
-        fn = TOOL_REGISTRY[name]
+    meta = _TOOL_META.get(name)
+    if meta is not None:
+        batch_queries: Optional[List[str]] = None
 
         # Caso speciale: hybrid_search → ripuliamo gli argomenti (niente return_properties)
         if name == "hybrid_search":
-            print("[call_tool] hybrid_search called with:", args)
+            if _MCP_LOGGER.isEnabledFor(logging.DEBUG):
+                _MCP_LOGGER.debug("hybrid_search args=%s", _compact_json(args))
 
-            clean_args: Dict[str, Any] = {}
-
-            # collection con default "WindChunk"
-            clean_args["collection"] = args.get("collection") or "WindChunk"
-
-            # query obbligatoria
+            # query obbligatoria (stringa o lista di stringhe per il batch)
             q = args.get("query")
+            if isinstance(q, list):
+                if not all(isinstance(x, str) and x.strip() for x in q):
+                    return _HYBRID_INVALID_BATCH_RESULT
+                if len(q) > _HYBRID_BATCH_MAX:
+                    return _HYBRID_BATCH_TOO_LARGE_RESULT
+                batch_queries = q
             if not q:
-                return types.ServerResult(
-                    types.CallToolResult(
-                        content=[
-                            types.TextContent(
-                                type="text",
-                                text="Errore: parametro obbligatorio 'query' mancante per hybrid_search.",
-                            )
-                        ],
-                        isError=True,
-                    )
-                )
-            clean_args["query"] = q
-
-            # parametri opzionali
-            if "limit" in args:
-                clean_args["limit"] = args["limit"]
-            if "alpha" in args:
-                clean_args["alpha"] = args["alpha"]
-            if "query_properties" in args:
-                clean_args["query_properties"] = args["query_properties"]
+                return _HYBRID_MISSING_QUERY_RESULT
 
             # 🔴 QUI LA COSA IMPORTANTE:
-            # sovrascriviamo args con la versione ripulita
+            # sovrascriviamo args con la versione ripulita: collection con
+            # default "WindChunk", query e solo i parametri opzionali ammessi
             # (così return_properties e qualsiasi altro extra SPARISCONO)
-            args = clean_args
+            args = {
+                "collection": args.get("collection") or "WindChunk",
+                "query": q,
+                **{k: args[k] for k in _HYBRID_ALLOWED & args.keys()},
+            }
+
+        # Passiamo solo gli argomenti previsti dalla firma del tool
+        # (i tool senza parametri ricevono quindi una chiamata senza args)
+        if not meta["accepts_var_kw"]:
+            params = meta["params"]
+            args = {k: v for k, v in args.items() if k in params}
+
+        if batch_queries:
+            call = _run_hybrid_batch(meta, args, batch_queries, _progress_sender(req))
+        elif name == "hybrid_search":
+            call = _run_hybrid(meta, args)
+        else:
+            call = _invoke_tool(meta, args)
 
-        # Tutti gli altri tool normali rimangono come prima
         try:
-            # Proviamo a passare gli argomenti così come sono
-            result = fn(**args)
-            # Se la funzione è async, await
-            if hasattr(result, "__await__"):
-                result = await result
-        except TypeError as e:
-            # Se la firma non combacia (ad es. tool senza parametri), riproviamo senza args
-            try:
-                result = fn()
-                if hasattr(result, "__await__"):
-                    result = await result
-            except Exception as e2:
-                return types.ServerResult(
-                    types.CallToolResult(
-                        content=[
-                            types.TextContent(
-                                type="text",
-                                text=f"Errore chiamando tool {name}: {e2}",
-                            )
-                        ],
-                        isError=True,
-                    )
-                )
+            result = await asyncio.wait_for(call, timeout=_TOOL_BUDGET_S)
+        except asyncio.TimeoutError:
+            _MCP_LOGGER.warning("tool %s exceeded budget of %s ms", name, _TOOL_BUDGET_MS)
+            return _budget_exceeded_result(name)
         except Exception as e:
             return types.ServerResult(
                 types.CallToolResult(
@@ -1009,31 +1511,25 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
 
         # A questo punto abbiamo "result" (sincrono o async già risolto)
 
-        import json as _json
-
-        # Normalizziamo il risultato in una forma strutturata
-        if isinstance(result, (dict, list)):
-            structured = result
-        else:
-            structured = {"result": result}
+        # Il risultato è già un dict (i tool che non lo restituiscono sono
+        # avvolti alla registrazione, vedi _build_tool_meta)
+        structured = result
 
-        # Creiamo una rappresentazione testuale generica (JSON pretty-print)
+        # Creiamo una rappresentazione testuale generica (JSON pretty-print via orjson)
         try:
-            text_repr = _json.dumps(structured, ensure_ascii=False, indent=2)
+            text_repr = orjson.dumps(structured, option=orjson.OPT_INDENT_2).decode()
         except Exception:
             text_repr = str(structured)
 
         # Per evitare risposte enormi, tronchiamo solo il testo (NON structuredContent)
-        max_chars = 6000
-        if len(text_repr) > max_chars:
-            text_repr = (
-                text_repr[:max_chars]
-                + "\n\n[Output troncato per lunghezza. I dati completi sono in structuredContent.]"
-            )
+        if len(text_repr) > _TEXT_MAX_CHARS:
+            text_repr = text_repr[:_TEXT_MAX_CHARS] + _TEXT_TRUNCATED_SUFFIX
+
+        text_msg = meta["text_prefix"] + text_repr
 
-        text_msg = (
-            f"Risultato del tool {name} in formato strutturato (JSON leggibile):\n\n"
-            f"{text_repr}"
+        # Batch: è un errore solo se tutte le query sono fallite
+        batch_failed = bool(batch_queries) and all(
+            "error" in item for item in structured["results"]
         )
 
         return types.ServerResult(
@@ -1045,21 +1541,12 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
                     )
                 ],
                 structuredContent=structured,
+                isError=batch_failed,
             )
         )
 
     # 3) Tool sconosciuto
-    return types.ServerResult(
-        types.CallToolResult(
-            content=[
-                types.TextContent(
-                    type="text",
-                    text=f"Unknown tool: {name}",
-                )
-            ],
-            isError=True,
-        )
-    )
+    return _unknown_tool_result(name)
 
 
 # Registra i request handler sul server MCP
@@ -1070,36 +1557,42 @@ mcp._mcp_server.request_handlers[types.ReadResourceRequest] = _handle_read_resou
 # ==== Esponi l'app ASGI per uvicorn (per uso diretto nello start command) ====
 # Puoi usare: uvicorn serve:app --host 0.0.0.0 --port $PORT
 # Come nell'esempio Pizzaz, usiamo semplicemente mcp.streamable_http_app()
-try:
-    app = mcp.streamable_http_app()
-    if app is None:
-        raise ValueError("streamable_http_app() returned None")
-    print("[mcp] app obtained via streamable_http_app()")
-except Exception as e:
-    print(f"[mcp] error getting app via streamable_http_app(): {e}")
-    # Fallback: prova a ottenere l'app in altri modi
-    from starlette.applications import Starlette
-    app = None
-    for attr_name in ["app", "_app", "asgi_app", "_asgi_app"]:
-        app = getattr(mcp, attr_name, None)
-        if app and isinstance(app, Starlette):
-            print(f"[mcp] found app via mcp.{attr_name} (fallback)")
-            break
-    if app is None:
-        raise RuntimeError("Cannot get FastMCP app - streamable_http_app() failed and no app found")
-
-# Aggiungi CORS middleware se disponibile (opzionale)
-try:
-    from starlette.middleware.cors import CORSMiddleware
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=["*"],
-        allow_methods=["*"],
-        allow_headers=["*"],
-        allow_credentials=False,
-    )
-except Exception:
-    pass
+app = mcp.streamable_http_app()
+if app is None or not isinstance(app, Starlette):
+    raise RuntimeError("streamable_http_app() did not return a Starlette app")
+print("[mcp] app obtained via streamable_http_app()")
+
+# Avvio/arresto nel lifespan dell'app, attorno a quello del session manager MCP
+_MCP_LIFESPAN = app.router.lifespan_context
+
+
+@asynccontextmanager
+async def _lifespan(app_):
+    await asyncio.to_thread(_startup)
+    try:
+        async with _MCP_LIFESPAN(app_):
+            yield
+    finally:
+        _VERTEX_STOP.set()
+        _close_client()
+
+
+app.router.lifespan_context = _lifespan
+
+# Alias /mcp <-> /mcp/ verso il path reale dell'endpoint MCP
+app.add_middleware(
+    _MCPPathAlias,
+    target=getattr(mcp.settings, "streamable_http_path", "/mcp"),
+)
+
+# CORS aperto: starlette è una dipendenza diretta, nessun import opzionale
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=_CORS_ALLOWED_ORIGINS,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    allow_credentials=False,
+)
 
 # ==== main: avvia il server con uvicorn ==================
 if __name__ == "__main__":
@@ -1107,7 +1600,17 @@ if __name__ == "__main__":
     
     host = "0.0.0.0"
     port = int(os.environ.get("PORT", "10000"))
-    
-    # Usa direttamente l'oggetto app che hai creato sopra
-    uvicorn.run(app, host=host, port=port)
+    workers = int(os.environ.get("WEB_CONCURRENCY") or 1)
+
+    # Con più worker uvicorn richiede l'import string; con un solo worker usiamo
+    # direttamente l'oggetto app (evita di importare serve.py una seconda volta).
+    # "auto" usa uvloop/httptools se installati, altrimenti asyncio/h11.
+    uvicorn.run(
+        "serve:app" if workers > 1 else app,
+        host=host,
+        port=port,
+        loop="auto",
+        http="auto",
+        workers=workers,
+    )
 